@@ -6,23 +6,31 @@ Prints basic stats and quality checks.
 
 import json
 import sys
+from collections import Counter
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # optional speedup, stdlib json works fine
+    orjson = None
+
 
 def evaluate(packs_path):
     # Load packs
-    packs = []
-    with open(packs_path) as f:
-        for line in f:
-            if line.strip():
-                packs.append(json.loads(line))
+    with open(packs_path, 'rb') as f:
+        data = f.read()
+    loads = orjson.loads if orjson else json.loads
+    packs = [loads(line) for line in data.splitlines() if line.strip()]
     
-    # Count labels
+    # Count labels, evidence and candidates in a single pass
     total = 0
-    counts = {"SUPPORTED": 0, "NOT_SUPPORTED": 0, "INSUFFICIENT": 0}
+    counts = Counter()
     with_evidence = 0
+    with_candidates = 0
     
     for pack in packs:
+        if pack.get("retrieval_log", {}).get("candidates"):
+            with_candidates += 1
         for claim in pack["claims"]:
             total += 1
             counts[claim["label"]] += 1
@@ -35,13 +43,14 @@ def evaluate(packs_path):
     print("=" * 50)
     
     print(f"\nLabel Distribution ({total} claims):")
-    for label, count in counts.items():
+    for label in ("SUPPORTED", "NOT_SUPPORTED", "INSUFFICIENT"):
+        count = counts[label]
         pct = 100 * count / total if total else 0
         print(f"  {label}: {count} ({pct:.0f}%)")
     
     print(f"\nEvidence Coverage:")
     print(f"  Claims with evidence: {with_evidence}/{total}")
-    print(f"  Packs with candidates: {sum(1 for p in packs if p.get('retrieval_log', {}).get('candidates'))}/{len(packs)}")
+    print(f"  Packs with candidates: {with_candidates}/{len(packs)}")
     
     # Warn on potential issues
     print(f"\nQuality Checks:")
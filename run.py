@@ -7,19 +7,73 @@ from a corpus of legal documents.
 """
 
 import argparse
+import copy
+import hashlib
+import heapq
 import json
 import os
 import re
+import shutil
+import sys
+import tempfile
 from pathlib import Path
-from dataclasses import dataclass, field
+from typing import NamedTuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
-from rank_bm25 import BM25Okapi
+import bm25s
+
+try:
+    import orjson
+except ImportError:  # optional speedup, stdlib json works fine
+    orjson = None
+
+
+# Compiled once here rather than per call in the hot loops
+_TOKEN_RE = re.compile(r'\w+')
+# Runs over a whole file in MULTILINE mode; [^\S\n] is "whitespace but not
+# newline", which gives the same result as strip()-ing each line first
+_LINE_RE = re.compile(r'^[^\S\n]*(L\d+):[^\S\n]*(\S.*?)[^\S\n]*$', re.MULTILINE)
+_DAYS_RE = re.compile(r'\b(\d+)\s*(?:working\s+)?days?\b')
+
+# Prohibitive phrasing in evidence (see notes/debug.md)
+_PROHIB_RE = re.compile(r'\b(?:do not|must not|should not|prohibited|never|cannot)\b')
+
+# Words indicating negation - whole words only, so "note" doesn't count as "not"
+# TODO: might want to expand this list based on testing
+_NEG_RE = re.compile(r'\b(?:not|never|no|cannot|prohibited|must not|should not)\b')
+
+
+@lru_cache(maxsize=8192)
+def _tok(text):
+    """Lowercase word tokens. Cached since the same evidence lines and
+    question text get tokenized over and over across claims."""
+    # Basic tokenization - could use nltk or spacy but this works fine
+    return tuple(_TOKEN_RE.findall(text.lower()))
+
+
+# Anything that changes what ends up in the index has to be part of the
+# cache key. Bump _TOKENIZER_VERSION when _tok changes in a way the regex
+# pattern alone doesn't show
+_TOKENIZER_VERSION = 1
+_BM25_PARAMS = {"method": "lucene", "k1": 1.5, "b": 0.75}
+_INDEX_TAG = (f"tok={_TOKENIZER_VERSION}:{_TOKEN_RE.pattern};"
+              f"bm25={sorted(_BM25_PARAMS.items())};bm25s={bm25s.__version__}")
+
+
+@lru_cache(maxsize=2048)
+def _analyze_claim(claim):
+    """(word set, negated?, day counts) for a claim. Cached since the same
+    claim text can turn up under more than one question."""
+    low = claim.lower()
+    return frozenset(_tok(claim)), bool(_NEG_RE.search(low)), tuple(_DAYS_RE.findall(low))
 
 
 # --- Data structures ---
+# NamedTuples rather than dataclasses: no per-instance __dict__, and still
+# works on 3.8 (dataclass slots= needs 3.10)
 
-@dataclass
-class DocLine:
+class DocLine(NamedTuple):
     """Single line from a document with its metadata."""
     doc_id: str
     line_num: str   # e.g. "L001"
@@ -30,22 +84,19 @@ class DocLine:
         return self.line_num
 
 
-@dataclass
-class Evidence:
+class Evidence(NamedTuple):
     doc_id: str
     location: str
     snippet: str
 
 
-@dataclass 
-class ClaimResult:
+class ClaimResult(NamedTuple):
     claim: str
     label: str  # SUPPORTED | NOT_SUPPORTED | INSUFFICIENT
-    evidence: list = field(default_factory=list)
+    evidence: tuple = ()
 
 
-@dataclass
-class Candidate:
+class Candidate(NamedTuple):
     doc_id: str
     score: float
     location: str
@@ -58,60 +109,120 @@ class DocumentLoader:
     
     def __init__(self, docs_dir):
         self.docs_dir = Path(docs_dir)
-        self.documents = {}
-        self.all_lines = []
+        # Lines are stored as parallel lists (same index = same line) instead
+        # of a DocLine per line; get_line() builds one when it's needed
+        self.documents = {}  # doc_id -> range of line indices
+        self.doc_ids = []
+        self.line_nums = []
+        self.contents = []
+        self._index = {}  # (doc_id, line_num) -> line index
         
     def load_all(self):
         for doc_path in sorted(self.docs_dir.glob("*.txt")):
             doc_id = doc_path.stem
-            lines = self._parse_doc(doc_id, doc_path)
-            self.documents[doc_id] = lines
-            self.all_lines.extend(lines)
+            start = len(self.contents)
+            for line_num, content in self._parse_doc(doc_path):
+                self._index[(doc_id, line_num)] = len(self.contents)
+                self.doc_ids.append(doc_id)
+                self.line_nums.append(line_num)
+                self.contents.append(content)
+            self.documents[doc_id] = range(start, len(self.contents))
         
-        print(f"Loaded {len(self.documents)} docs, {len(self.all_lines)} lines")
+        print(f"Loaded {len(self.documents)} docs, {len(self.contents)} lines")
     
-    def _parse_doc(self, doc_id, path):
-        """Extract lines matching pattern L001: content..."""
-        lines = []
-        with open(path, 'r', encoding='utf-8') as f:
-            for raw_line in f:
-                raw_line = raw_line.strip()
-                match = re.match(r'^(L\d+):\s*(.+)$', raw_line)
-                if match:
-                    line_num, content = match.groups()
-                    lines.append(DocLine(doc_id, line_num, content))
-        return lines
+    def get_line(self, doc_id, line_num):
+        """Look up a line by e.g. ("doc01", "L002"); None if there's no such line."""
+        idx = self._index.get((doc_id, line_num))
+        if idx is None:
+            return None
+        return DocLine(doc_id, line_num, self.contents[idx])
+    
+    def _parse_doc(self, path):
+        """Extract (line_num, content) from lines like L001: content..."""
+        with open(path, 'rb') as f:
+            data = f.read().decode('utf-8')
+        return [m.groups() for m in _LINE_RE.finditer(data)]
 
 
 # --- BM25 retrieval ---
 
 class Retriever:
-    """Simple BM25-based retriever."""
+    """Simple BM25-based retriever (BM25S sparse index)."""
     
-    def __init__(self, lines):
-        self.lines = lines
-        # Build corpus for BM25
-        corpus = [self._tokenize(ln.content) for ln in lines]
-        self.bm25 = BM25Okapi(corpus)
-        print(f"Indexed {len(lines)} lines for retrieval")
+    def __init__(self, doc_ids, line_nums, contents, cache_dir=".bm25_cache"):
+        # Same parallel lists as DocumentLoader, not copies
+        self.doc_ids = doc_ids
+        self.line_nums = line_nums
+        self.contents = contents
+        
+        # Index is keyed on the line contents (plus tokenizer/BM25 settings),
+        # so any edit to the docs produces a new key and the stale index is
+        # just never loaded again
+        index_dir = None
+        if cache_dir:
+            key = hashlib.blake2b(
+                _INDEX_TAG.encode() + b"\0" + b"\n".join(c.encode() for c in contents),
+                digest_size=16,
+            ).hexdigest()
+            index_dir = Path(cache_dir) / key
+        
+        if index_dir is not None and index_dir.is_dir():
+            self.bm25 = bm25s.BM25.load(index_dir, mmap=True, show_progress=False)
+            print(f"Loaded cached index for {len(contents)} lines")
+            return
+        
+        # BM25S keeps the scores in a sparse matrix, so querying is a single
+        # sparse lookup instead of a Python loop over every line
+        self.bm25 = bm25s.BM25(**_BM25_PARAMS)
+        self.bm25.index([list(_tok(c)) for c in contents], show_progress=False)
+        print(f"Indexed {len(contents)} lines for retrieval")
+        
+        if index_dir is not None:
+            self._save_index(index_dir)
     
-    def _tokenize(self, text):
-        # Basic tokenization - could use nltk or spacy but this works fine
-        return re.findall(r'\w+', text.lower())
+    def _save_index(self, index_dir):
+        """Best effort - if the cache can't be written we just run without it."""
+        try:
+            index_dir.parent.mkdir(parents=True, exist_ok=True)
+            # Save into a private temp dir and rename, so an interrupted or
+            # concurrent run can't leave (or clobber) a half-written index
+            tmp_dir = tempfile.mkdtemp(prefix=index_dir.name + ".", suffix=".tmp",
+                                       dir=index_dir.parent)
+            try:
+                self.bm25.save(tmp_dir, show_progress=False)
+                os.replace(tmp_dir, index_dir)
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                # Another run saved the same index first - keep theirs
+                if not index_dir.is_dir():
+                    raise
+        except OSError as e:
+            print(f"Warning: not caching BM25 index ({e})", file=sys.stderr)
     
     def search(self, query, top_k=10):
-        """Return top-k (DocLine, score) pairs."""
-        tokens = self._tokenize(query)
-        scores = self.bm25.get_scores(tokens)
+        """Return top-k (line index, score) pairs, indexing the line lists."""
+        return self.search_tokens([list(_tok(query))], top_k=top_k)[0]
+    
+    def search_tokens(self, token_lists, top_k=10):
+        """Like search(), but for a whole batch of already tokenized queries,
+        scored in one go. Returns one list of hits per query."""
+        if not token_lists:
+            return []
+        
+        # BM25S refuses k larger than the corpus
+        k = min(top_k, len(self.contents))
         
-        # Sort by score descending
-        ranked = sorted(enumerate(scores), key=lambda x: -x[1])[:top_k]
+        # Comes back sorted by score descending
+        indices, scores = self.bm25.retrieve(token_lists, k=k, show_progress=False)
         
-        results = []
-        for idx, score in ranked:
-            if score > 0:
-                results.append((self.lines[idx], score))
-        return results
+        all_results = []
+        for row_idx, row_scores in zip(indices, scores):
+            results = []
+            for idx, score in zip(row_idx, row_scores):
+                if score > 0:
+                    results.append((int(idx), float(score)))
+            all_results.append(results)
+        return all_results
 
 
 # --- Claim verification ---
@@ -119,77 +230,104 @@ class Retriever:
 class ClaimVerifier:
     """Checks if retrieved evidence supports/contradicts claims."""
     
-    # Words indicating negation
-    # TODO: might want to expand this list based on testing
-    NEGATION_WORDS = {'not', 'never', 'no', 'cannot', 'prohibited'}
-    
     # BM25 score threshold - below this we consider it weak match
     # FIXME: 3.0 works ok for this dataset but may need tuning
     MIN_SCORE = 3.0
     
     def __init__(self, retriever):
         self.retriever = retriever
+        # The line lists are all verification itself reads; holding them
+        # directly lets for_worker() leave the BM25 index behind
+        self.doc_ids = retriever.doc_ids
+        self.line_nums = retriever.line_nums
+        self.contents = retriever.contents
+        self._line_info = {}  # line index -> evidence analysis, see _analyze_line
+    
+    def for_worker(self):
+        """Copy for worker processes, which only ever get precomputed hits,
+        without the retriever so the index isn't pickled to every worker."""
+        worker = copy.copy(self)
+        worker.retriever = None
+        return worker
+    
+    def query_tokens(self, claim, question):
+        # Combine question + claim for better retrieval. Same tokens as
+        # f"{question} {claim}", but the question half comes out of the
+        # _tok cache after its first claim
+        return list(_tok(question) + _tok(claim))
     
-    def verify(self, claim, question):
-        """Verify claim and return (ClaimResult, list of candidates)."""
+    def verify(self, claim, question, hits=None):
+        """Verify claim and return (ClaimResult, list of candidates).
         
-        # Combine question + claim for better retrieval
-        query = f"{question} {claim}"
-        hits = self.retriever.search(query, top_k=10)
+        `hits` can be passed in when retrieval was already done in a batch.
+        """
+        if hits is None:
+            hits = self.retriever.search_tokens(
+                [self.query_tokens(claim, question)], top_k=10)[0]
+        # Only the top-k hits ever get turned into DocLine objects
+        lines = [DocLine(self.doc_ids[idx], self.line_nums[idx], self.contents[idx])
+                 for idx, _ in hits]
         
         # Build candidate list for logging
         candidates = [
             Candidate(doc_id=ln.doc_id, score=round(sc, 2), location=ln.location)
-            for ln, sc in hits
+            for ln, (_, sc) in zip(lines, hits)
         ]
         
-        # Try to find supporting or contradicting evidence
-        for line, score in hits:
+        # Claim side of the comparison is the same for every candidate
+        claim_info = _analyze_claim(claim)
+        
+        # Try to find supporting or contradicting evidence. Hits are sorted
+        # by score, so once one falls below the threshold the rest do too
+        for line, (idx, score) in zip(lines, hits):
             if score < self.MIN_SCORE:
-                continue
+                break
             
-            verdict = self._check_support(claim, line.content)
+            verdict = self._check_support(claim_info, self._analyze_line(idx))
             
             if verdict in ("SUPPORTED", "NOT_SUPPORTED"):
                 ev = Evidence(doc_id=line.doc_id, location=line.location, 
                              snippet=line.content)
-                return ClaimResult(claim, verdict, [ev]), candidates
+                return ClaimResult(claim, verdict, (ev,)), candidates
         
         # No strong evidence found
-        return ClaimResult(claim, "INSUFFICIENT", []), candidates
+        return ClaimResult(claim, "INSUFFICIENT"), candidates
+    
+    def _analyze_line(self, idx):
+        """(word set, negated?, prohibits?, day counts) for corpus line `idx`,
+        worked out once per line."""
+        info = self._line_info.get(idx)
+        if info is None:
+            content = self.contents[idx]
+            ev_low = content.lower()
+            info = self._line_info[idx] = (
+                frozenset(_tok(content)),
+                bool(_NEG_RE.search(ev_low)),
+                # Handle "do not", "must not" patterns - this fixed a nasty bug
+                # where "may cite" was matching "Do not cite" as SUPPORTED
+                bool(_PROHIB_RE.search(ev_low)),
+                tuple(_DAYS_RE.findall(ev_low)),
+            )
+        return info
     
-    def _check_support(self, claim, evidence):
+    def _check_support(self, claim_info, ev_info):
         """
-        Compare claim against evidence text.
+        Compare an analysed claim (see _analyze_claim) against an analysed
+        evidence line (see _analyze_line).
         Returns: SUPPORTED, NOT_SUPPORTED, or INSUFFICIENT
         """
-        claim_low = claim.lower()
-        ev_low = evidence.lower()
-        
-        # Get word sets
-        claim_words = set(re.findall(r'\w+', claim_low))
-        ev_words = set(re.findall(r'\w+', ev_low))
+        claim_words, claim_negated, claim_nums = claim_info
+        ev_words, ev_negated, ev_prohibits, ev_nums = ev_info
         
         # Calculate overlap
         overlap = claim_words & ev_words
         overlap_pct = len(overlap) / len(claim_words) if claim_words else 0
         
-        # Check for negation mismatch
-        claim_negated = any(neg in claim_low for neg in self.NEGATION_WORDS)
-        ev_negated = any(neg in ev_low for neg in self.NEGATION_WORDS)
-        
-        # Handle "do not", "must not" patterns - this fixed a nasty bug
-        # where "may cite" was matching "Do not cite" as SUPPORTED
-        prohibition_patterns = [r'\bdo not\b', r'\bmust not\b', r'\bshould not\b', 
-                               r'\bprohibited\b', r'\bnever\b', r'\bcannot\b']
-        ev_prohibits = any(re.search(p, ev_low) for p in prohibition_patterns)
-        
+        # Evidence prohibits but claim isn't negated -> contradiction
         if ev_prohibits and not claim_negated and overlap_pct >= 0.3:
             return "NOT_SUPPORTED"
         
         # Check for numeric mismatch (e.g. "7 days" vs "3 days")
-        claim_nums = re.findall(r'\b(\d+)\s*(?:working\s+)?days?\b', claim_low)
-        ev_nums = re.findall(r'\b(\d+)\s*(?:working\s+)?days?\b', ev_low)
         if claim_nums and ev_nums and claim_nums[0] != ev_nums[0]:
             return "NOT_SUPPORTED"
         
@@ -206,21 +344,27 @@ class ClaimVerifier:
 
 def load_jsonl(path):
     """Load a JSONL file into a list of dicts."""
-    items = []
-    with open(path, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():
-                items.append(json.loads(line))
-    return items
+    # One read + one split instead of decoding line by line;
+    # both orjson and json accept bytes directly
+    with open(path, 'rb') as f:
+        data = f.read()
+    loads = orjson.loads if orjson else json.loads
+    return [loads(line) for line in data.splitlines() if line.strip()]
 
 
-def make_pack(qid, question, claims, verifier):
-    """Generates verification pack for a single question."""
+def make_pack(qid, question, claims, verifier, hits=None):
+    """Generates verification pack for a single question.
+    
+    `hits` is an optional list of precomputed search results, one per claim.
+    """
     results = []
     all_candidates = []
     
-    for claim in claims:
-        result, candidates = verifier.verify(claim, question)
+    if hits is None:
+        hits = [None] * len(claims)
+    
+    for claim, claim_hits in zip(claims, hits):
+        result, candidates = verifier.verify(claim, question, hits=claim_hits)
         results.append(result)
         all_candidates.extend(candidates)
     
@@ -228,15 +372,18 @@ def make_pack(qid, question, claims, verifier):
     supported = [r.claim for r in results if r.label == "SUPPORTED"]
     answer = "; ".join(supported) if supported else "Insufficient evidence to answer."
     
-    # Deduplicate candidates
-    seen = set()
-    unique = []
-    # Sort by score for better quality
-    for c in sorted(all_candidates, key=lambda x: -x.score):
+    # Deduplicate candidates, keeping the best score per line. A key whose
+    # score improves is moved to the end, so equal scores keep the order
+    # the old sort-then-dedupe gave
+    best = {}
+    for c in all_candidates:
         key = (c.doc_id, c.location)
-        if key not in seen:
-            seen.add(key)
-            unique.append(c)
+        cur = best.get(key)
+        if cur is None or c.score > cur.score:
+            best.pop(key, None)
+            best[key] = c
+    # Only the top 10 unique ones get logged
+    unique = heapq.nlargest(10, best.values(), key=lambda c: c.score)
     
     return {
         "qid": qid,
@@ -253,24 +400,63 @@ def make_pack(qid, question, claims, verifier):
         "retrieval_log": {
             "top_k": 10,
             "candidates": [{"doc_id": c.doc_id, "score": c.score, 
-                           "location": c.location} for c in unique[:10]]
+                           "location": c.location} for c in unique]
         }
     }
 
 
+# Per-process verifier for the worker pool, set once by _init_worker
+_worker_verifier = None
+
+
+def _init_worker(verifier):
+    global _worker_verifier
+    _worker_verifier = verifier
+
+
+def _pack_worker(job):
+    qid, question, claims, hits = job
+    return make_pack(qid, question, claims, _worker_verifier, hits=hits)
+
+
+def _generate_packs(jobs, verifier, workers):
+    """Yield packs in job order, from a process pool if workers > 1."""
+    # Questions are independent, so spread them over processes.
+    # map() keeps input order, so output stays sorted by qid
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(verifier.for_worker(),)) as ex:
+            yield from ex.map(_pack_worker, jobs, chunksize=4)
+    else:
+        _init_worker(verifier)
+        for job in jobs:
+            yield _pack_worker(job)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generate verification packs")
     parser.add_argument("--docs", required=True, help="Documents directory")
     parser.add_argument("--questions", required=True, help="questions.jsonl path")
     parser.add_argument("--claims", required=True, help="claims.jsonl path")
     parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--cache-dir", default=".bm25_cache",
+                        help="Where to keep the BM25 index between runs")
+    # Verification is cheap next to retrieval, so a pool only pays off on
+    # large claim sets; the default stays in-process
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for verification (default 1 = no pool)")
     args = parser.parse_args()
     
+    # Don't carry token caches over between runs in the same process
+    _tok.cache_clear()
+    _analyze_claim.cache_clear()
+    
     # Setup pipeline
     loader = DocumentLoader(args.docs)
     loader.load_all()
     
-    retriever = Retriever(loader.all_lines)
+    retriever = Retriever(loader.doc_ids, loader.line_nums, loader.contents,
+                          cache_dir=args.cache_dir)
     verifier = ClaimVerifier(retriever)
     
     # Load input data
@@ -281,25 +467,48 @@ def main():
     os.makedirs(args.out, exist_ok=True)
     out_path = os.path.join(args.out, "packs.jsonl")
     
-    packs = []
-    for qid in sorted(questions.keys()):
-        # Merged PackGenerator into a single function here
-        # Feels more like a script than an app now
-        pack = make_pack(qid, questions[qid], claims_map.get(qid, []), verifier)
-        packs.append(pack)
-        print(f"Generated {qid}")
+    qids = sorted(questions.keys())
+    
+    # Retrieve for every claim of every question in one batch up front;
+    # verification itself is cheap and stays per claim
+    queries = [verifier.query_tokens(claim, questions[qid])
+               for qid in qids for claim in claims_map.get(qid, [])]
+    all_hits = retriever.search_tokens(queries, top_k=10)
     
-    # Write output
-    with open(out_path, 'w', encoding='utf-8') as f:
-        for p in packs:
-            f.write(json.dumps(p, ensure_ascii=False) + '\n')
+    # Merged PackGenerator into a single function here
+    # Feels more like a script than an app now
+    jobs = []
+    pos = 0
+    for qid in qids:
+        claims = claims_map.get(qid, [])
+        jobs.append((qid, questions[qid], claims, all_hits[pos:pos + len(claims)]))
+        pos += len(claims)
+    
+    # Stream each pack to disk as it comes back instead of holding them all;
+    # stats are counted on the way past
+    n_packs = total = sup = notsup = 0
+    with open(out_path, 'wb') as f:
+        for p in _generate_packs(jobs, verifier, args.workers):
+            if orjson:
+                f.write(orjson.dumps(p))
+            else:
+                f.write(json.dumps(p, ensure_ascii=False).encode('utf-8'))
+            f.write(b'\n')
+            
+            n_packs += 1
+            for c in p["claims"]:
+                total += 1
+                if c["label"] == "SUPPORTED":
+                    sup += 1
+                elif c["label"] == "NOT_SUPPORTED":
+                    notsup += 1
+            # Progress every 100 packs rather than one line per pack
+            if n_packs % 100 == 0:
+                print(f"[{n_packs}/{len(jobs)}] generated", file=sys.stderr)
     
-    print(f"\nDone! Wrote {len(packs)} packs to {out_path}")
+    print(f"\nDone! Wrote {n_packs} packs to {out_path}")
     
     # Quick stats
-    total = sum(len(p["claims"]) for p in packs)
-    sup = sum(1 for p in packs for c in p["claims"] if c["label"] == "SUPPORTED")
-    notsup = sum(1 for p in packs for c in p["claims"] if c["label"] == "NOT_SUPPORTED")
     insuf = total - sup - notsup
     
     print(f"\nStats: {total} claims total")